@@ -63,7 +63,7 @@ class StructPacker(BasePacker, metaclass=StructPackerMeta):
 
     @classmethod
     def unpack_pk(cls, data):
-        (user_pk,) = struct.unpack(cls.fmt, data[: cls.size])
+        (user_pk,) = struct.unpack_from(cls.fmt, data)
         return user_pk, data[cls.size :]
 
 
@@ -134,6 +134,20 @@ def reload(*, setting, **kwargs):
 
         packers.packer = packers.get_packer()
 
+    if setting == "SESAME_PRIMARY_KEY_FIELD":
+        from . import tokens_v2
+
+        tokens_v2.primary_key_getter = tokens_v2.get_primary_key_getter()
+
+    if setting in [
+        "SESAME_INVALIDATE_ON_PASSWORD_CHANGE",
+        "SESAME_INVALIDATE_ON_EMAIL_CHANGE",
+        "SESAME_ONE_TIME",
+    ]:
+        from . import tokens_v2
+
+        tokens_v2.revocation_key_components = tokens_v2.get_revocation_key_components()
+
     if setting in ["SESAME_SALT", "SESAME_MAX_AGE"]:
         from . import tokens_v1
 
@@ -1,11 +1,13 @@
 import base64
 import datetime
+import functools
 import hashlib
-import hmac
 import logging
-import re
+import operator
+import string
 import struct
 import time
+from hmac import compare_digest
 
 from . import packers, settings
 
@@ -15,6 +17,8 @@ logger = logging.getLogger("sesame")
 
 TIMESTAMP_OFFSET = 1577836800  # 2020-01-01T00:00:00Z
 
+timestamp_struct = struct.Struct("!i")
+
 
 def pack_timestamp():
     """
@@ -26,21 +30,23 @@ def pack_timestamp():
     if settings.MAX_AGE is None:
         return b""
     timestamp = int(time.time()) - TIMESTAMP_OFFSET
-    return struct.pack("!i", timestamp)
+    return timestamp_struct.pack(timestamp)
 
 
-def unpack_timestamp(data):
+def unpack_timestamp(data, offset):
     """
     When SESAME_MAX_AGE is enabled, extract the timestamp and calculate the age.
 
-    Return an age in seconds or None and the remaining bytes.
+    Read ``data`` starting at ``offset`` rather than slicing it.
+
+    Return an age in seconds or None and the offset of the remaining bytes.
 
     """
     if settings.MAX_AGE is None:
-        return None, data
-    # If data contains less than 4 bytes, this raises struct.error.
-    (timestamp,), data = struct.unpack("!i", data[:4]), data[4:]
-    return int(time.time()) - TIMESTAMP_OFFSET - timestamp, data
+        return None, offset
+    # If data contains less than 4 bytes after offset, this raises struct.error.
+    (timestamp,) = timestamp_struct.unpack_from(data, offset)
+    return int(time.time()) - TIMESTAMP_OFFSET - timestamp, offset + 4
 
 
 HASH_SIZES = {
@@ -55,22 +61,13 @@ HASH_SIZES = {
 }
 
 
-def get_revocation_key(user):
+def password_revocation_key(user):
     """
-    When the value returned by this method changes, this revokes tokens.
-
-    It is derived from the hashed password so that changing the password
-    revokes tokens.
-
-    It may be derived from the email so that changing the email revokes tokens
-    too.
+    Extract the hash from the hashed password of a user.
 
-    For one-time tokens, it also contains the last login datetime so that
-    logging in revokes existing tokens.
+    Return bytes.
 
     """
-    data = ""
-
     # Tokens generated by django-sesame are more likely to leak than hashed
     # passwords. To minimize the information tokens might be revealing, we'd
     # like to use only hashes, excluding salts, as suggested in issue #40.
@@ -94,35 +91,154 @@ def get_revocation_key(user):
     # so I'm not comfortable reusing it. Also, for clarity, I don't want to
     # chain more cryptographic operations than needed.
 
-    if settings.INVALIDATE_ON_PASSWORD_CHANGE and user.password is not None:
-        algorithm = user.password.partition("$")[0]
-        try:
-            hash_size = HASH_SIZES[algorithm]
-        except KeyError:
-            data += user.password
-        else:
-            data += user.password[-hash_size:]
+    if user.password is None:
+        return b""
+    # Unusable passwords don't match any algorithm. Avoid raising and
+    # catching KeyError for them, which is comparatively slow.
+    hash_size = HASH_SIZES.get(user.password.partition("$")[0])
+    if hash_size is None:
+        return user.password.encode()
+    return user.password[-hash_size:].encode()
+
+
+@functools.lru_cache
+def get_email_getter(user_class):
+    """
+    Create a function returning the email of users of a given class.
+
+    """
+    return operator.attrgetter(user_class.get_email_field_name())
+
+
+def email_revocation_key(user):
+    """
+    Extract the email of a user.
+
+    Return bytes.
+
+    """
+    return get_email_getter(type(user))(user).encode()
+
+
+def last_login_revocation_key(user):
+    """
+    Extract the last login datetime of a user.
+
+    Return bytes.
+
+    """
+    if user.last_login is None:
+        return b""
+    return user.last_login.isoformat().encode()
+
 
+def get_revocation_key_components():
+    """
+    Select functions building the revocation key according to settings.
+
+    This avoids evaluating settings for every token.
+
+    """
+    components = []
+    if settings.INVALIDATE_ON_PASSWORD_CHANGE:
+        components.append(password_revocation_key)
     if settings.INVALIDATE_ON_EMAIL_CHANGE:
-        data += getattr(user, user.get_email_field_name())
+        components.append(email_revocation_key)
+    if settings.ONE_TIME:
+        components.append(last_login_revocation_key)
+    return tuple(components)
 
-    if settings.ONE_TIME and user.last_login is not None:
-        data += user.last_login.isoformat()
 
-    return data.encode()
+revocation_key_components = get_revocation_key_components()
 
 
-def sign(data, key, size):
+def get_revocation_key(user):
     """
-    Create a MAC with keyed hashing.
+    When the value returned by this method changes, this revokes tokens.
+
+    It is derived from the hashed password so that changing the password
+    revokes tokens.
+
+    It may be derived from the email so that changing the email revokes tokens
+    too.
+
+    For one-time tokens, it also contains the last login datetime so that
+    logging in revokes existing tokens.
+
+    """
+    # Encoding each component separately gives the same result as encoding
+    # their concatenation, because UTF-8 is a prefix code.
+    data = bytearray()
+    for component in revocation_key_components:
+        data += component(user)
+    return bytes(data)
+
+
+@functools.lru_cache(maxsize=16)
+def get_hasher(key, size):
+    """
+    Create a keyed hasher, to be copied before use.
+
+    Initializing the hasher processes the key, which takes a significant share
+    of the work for short messages. Caching it avoids repeating that work.
 
     """
     return hashlib.blake2b(
-        data,
         digest_size=size,
         key=key,
         person=b"sesame.tokens_v2",
-    ).digest()
+    )
+
+
+def sign(data, key, size):
+    """
+    Create a MAC with keyed hashing.
+
+    """
+    # hashlib.blake2b is implemented in C. Messages are short, so call overhead
+    # dominates: third-party BLAKE2b bindings, e.g. libsodium via PyNaCl, are
+    # several times slower here. Switching to another algorithm such as BLAKE3
+    # isn't an option because it would invalidate all existing tokens.
+    hasher = get_hasher(key, size).copy()
+    hasher.update(data)
+    return hasher.digest()
+
+
+def verify_signature(data, signature, size):
+    """
+    Check a MAC created with keyed hashing with any verification key.
+
+    """
+    verification_keys = settings.VERIFICATION_KEYS
+    # Unless SECRET_KEY_FALLBACKS is set, there's only one verification key.
+    if len(verification_keys) == 1:
+        return compare_digest(signature, sign(data, verification_keys[0], size))
+    for verification_key in verification_keys:
+        if compare_digest(signature, sign(data, verification_key, size)):
+            return True
+    return False
+
+
+@functools.lru_cache(maxsize=32)
+def encode_scope(scope):
+    """
+    Convert a scope to bytes.
+
+    Applications use a handful of scopes, so caching the result is effective.
+
+    """
+    return scope.encode()
+
+
+def get_primary_key_getter():
+    """
+    Create a function returning the primary key of a user according to settings.
+
+    """
+    return operator.attrgetter(settings.PRIMARY_KEY_FIELD)
+
+
+primary_key_getter = get_primary_key_getter()
 
 
 def create_token(user, scope=""):
@@ -130,12 +246,12 @@ def create_token(user, scope=""):
     Create a v2 signed token for a user.
 
     """
-    primary_key = packers.packer.pack_pk(getattr(user, settings.PRIMARY_KEY_FIELD))
+    primary_key = packers.packer.pack_pk(primary_key_getter(user))
     timestamp = pack_timestamp()
     revocation_key = get_revocation_key(user)
 
     signature = sign(
-        primary_key + timestamp + revocation_key + scope.encode(),
+        b"".join((primary_key, timestamp, revocation_key, encode_scope(scope))),
         settings.SIGNING_KEY,
         settings.SIGNATURE_SIZE,
     )
@@ -147,11 +263,19 @@ def create_token(user, scope=""):
     return token.decode()
 
 
+# Padding to restore before decoding a token, indexed by its length modulo 4.
+base64_padding = (b"", b"===", b"==", b"=")
+
+
 def parse_token(token, get_user, scope="", max_age=None):
     """
     Obtain a user from a v2 signed token.
 
     """
+    # Read settings once. Don't cache them across calls: they may be reloaded.
+    signature_size = settings.SIGNATURE_SIZE
+    settings_max_age = settings.MAX_AGE
+
     token = token.encode()
 
     # Below, error messages should give a hint to developers debugging apps
@@ -159,26 +283,31 @@ def parse_token(token, get_user, scope="", max_age=None):
     # get truncated by accident.
 
     try:
-        data = base64.urlsafe_b64decode(token + b"=" * (-len(token) % 4))
+        data = base64.urlsafe_b64decode(token + base64_padding[len(token) % 4])
     except Exception:
         logger.debug("Bad token: cannot decode token")
         return None
 
     # Extract user primary key, token age, and signature from token.
 
+    # Track offsets in data to avoid creating intermediate bytestrings.
+    # Packers are a public API, so unpack_pk() still returns remaining bytes.
+
     try:
         user_pk, timestamp_and_signature = packers.packer.unpack_pk(data)
     except Exception:
         logger.debug("Bad token: cannot extract primary key")
         return None
+    offset = len(data) - len(timestamp_and_signature)
 
     try:
-        age, signature = unpack_timestamp(timestamp_and_signature)
+        age, offset = unpack_timestamp(data, offset)
     except Exception:
         logger.debug("Bad token: cannot extract timestamp")
         return None
 
-    if len(signature) != settings.SIGNATURE_SIZE:
+    signature = data[offset:]
+    if len(signature) != signature_size:
         logger.debug("Bad token: cannot extract signature")
         return None
 
@@ -191,11 +320,14 @@ def parse_token(token, get_user, scope="", max_age=None):
     # Determining whether there's a user with a given primary key via a timing
     # attack is acceptable within django-sesame's threat model.
 
+    # However, when the revocation key is empty, it doesn't depend on the user.
+    # Then we verify the signature first, saving a query for invalid tokens.
+
     # Check if token is expired. Perform this check first, because it's fast.
 
     if max_age is None:
-        max_age = settings.MAX_AGE
-    elif settings.MAX_AGE is None:
+        max_age = settings_max_age
+    elif settings_max_age is None:
         logger.warning(
             "Ignoring max_age argument; "
             "it isn't supported when SESAME_MAX_AGE = None"
@@ -206,6 +338,23 @@ def parse_token(token, get_user, scope="", max_age=None):
         logger.debug("Expired token: age = %d seconds", age)
         return None
 
+    primary_key_and_timestamp = data[:offset]
+    log_scope = "in default scope" if scope == "" else f"in scope {scope}"
+
+    # Check if signature is valid, if it doesn't depend on the user.
+
+    verify_before_get_user = not revocation_key_components
+    if verify_before_get_user:
+        message = primary_key_and_timestamp + encode_scope(scope)
+        if not verify_signature(message, signature, signature_size):
+            logger.debug(
+                "Invalid token for user %s = %r %s",
+                settings.PRIMARY_KEY_FIELD,
+                user_pk,
+                log_scope,
+            )
+            return None
+
     # Check if user exists and can log in.
 
     user = get_user(user_pk)
@@ -217,24 +366,17 @@ def parse_token(token, get_user, scope="", max_age=None):
         )
         return None
 
-    # Check if signature is valid
+    # Check if signature is valid, if it wasn't checked already.
 
-    primary_key_and_timestamp = data[: -settings.SIGNATURE_SIZE]
-    revocation_key = get_revocation_key(user)
-    for verification_key in settings.VERIFICATION_KEYS:
-        expected_signature = sign(
-            primary_key_and_timestamp + revocation_key + scope.encode(),
-            verification_key,
-            settings.SIGNATURE_SIZE,
-        )
-        if hmac.compare_digest(signature, expected_signature):
-            log_scope = "in default scope" if scope == "" else f"in scope {scope}"
-            logger.debug("Valid token for user %s %s", user, log_scope)
-            return user
+    if not verify_before_get_user:
+        revocation_key = get_revocation_key(user)
+        message = primary_key_and_timestamp + revocation_key + encode_scope(scope)
+        if not verify_signature(message, signature, signature_size):
+            logger.debug("Invalid token for user %s %s", user, log_scope)
+            return None
 
-    log_scope = "in default scope" if scope == "" else f"in scope {scope}"
-    logger.debug("Invalid token for user %s %s", user, log_scope)
-    return None
+    logger.debug("Valid token for user %s %s", user, log_scope)
+    return user
 
 
 # Tokens are arbitrary Base64-encoded bytestrings. Their size depends on
@@ -242,7 +384,9 @@ def parse_token(token, get_user, scope="", max_age=None):
 # - without SESAME_MAX_AGE: 4 + 10 = 14 bytes = 19 Base64 characters.
 # - with SESAME_MAX_AGE: 4 + 4 + 10 = 18 bytes = 24 Base64 characters.
 # Minimum "sensible" size is 1 + 0 + 2 = 3 bytes = 4 Base64 characters.
-token_re = re.compile(r"[A-Za-z0-9-_]{4,}")
+# Deleting all characters of the URL-safe Base64 alphabet with str.translate()
+# must yield an empty string. This is faster than a regular expression.
+token_alphabet = str.maketrans("", "", string.ascii_letters + string.digits + "-_")
 
 
 def detect_token(token):
@@ -250,4 +394,4 @@ def detect_token(token):
     Tell whether token may be a v2 signed token.
 
     """
-    return token_re.fullmatch(token) is not None
+    return len(token) >= 4 and not token.translate(token_alphabet)
@@ -85,6 +85,13 @@ class TestTokensV2(CaptureLogMixin, CreateUserMixin, TestCase):
         self.assertIsNone(user)
         self.assertLogsContain("Bad token")
 
+    def test_detect_token_rejects_short_or_non_base64_strings(self):
+        self.assertFalse(detect_token(""))
+        self.assertFalse(detect_token("abc"))
+        self.assertFalse(detect_token("abc="))
+        self.assertFalse(detect_token("abcé"))
+        self.assertTrue(detect_token("a-b_"))
+
     def test_unknown_user(self):
         token = create_token(self.user)
         self.user.delete()
@@ -187,6 +194,19 @@ class TestTokensV2(CaptureLogMixin, CreateUserMixin, TestCase):
         self.assertEqual(user, self.user)
         self.assertLogsContain("Valid token for user john in default scope")
 
+    @override_settings(
+        SESAME_INVALIDATE_ON_PASSWORD_CHANGE=False,
+        SESAME_MAX_AGE=300,
+    )
+    def test_invalid_token_without_revocation_key_skips_database(self):
+        token = create_token(self.user)
+        # Alter the last character, which is in the signature.
+        token = token[:-1] + ("A" if token[-1] != "A" else "B")
+        with self.assertNumQueries(0):
+            user = parse_token(token, self.get_user)
+        self.assertIsNone(user)
+        self.assertLogsContain("Invalid token for user pk = 1 in default scope")
+
     # Test token invalidation on email change
 
     def test_valid_token_after_email_change(self):
@@ -206,6 +226,24 @@ class TestTokensV2(CaptureLogMixin, CreateUserMixin, TestCase):
         self.assertIsNone(user)
         self.assertLogsContain("Invalid token for user john in default scope")
 
+    # Test revocation key
+
+    @override_settings(
+        SESAME_INVALIDATE_ON_EMAIL_CHANGE=True,
+        SESAME_ONE_TIME=True,
+    )
+    def test_revocation_key_components(self):
+        self.user.email = "jöhn@example.com"
+        self.user.save()
+        self.assertEqual(
+            get_revocation_key(self.user),
+            (
+                self.user.password[-32:]  # MD5 hash
+                + self.user.email
+                + self.user.last_login.isoformat()
+            ).encode(),
+        )
+
     # Test scoped tokens
 
     def test_valid_scoped_token_in_scope(self):
@@ -457,4 +495,4 @@ class TestTokensV2(CaptureLogMixin, CreateUserMixin, TestCase):
 
         user = parse_token(token, self.get_user)
         self.assertIsNone(user)
-        self.assertLogsContain("Invalid token for user jane")
+        self.assertLogsContain(f"Invalid token for user pk = {user2.pk}")